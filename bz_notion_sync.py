@@ -1,12 +1,17 @@
 import bzsettings
 import libs.bzhelper as bzhelper
+import logging
 import os
 
-from libs.notion_data import NotionDatabase
-from notion_client import Client
+from libs.notion_data import NotionClient, NotionDatabase
+
+# Log level can be overridden with the LOG_LEVEL environment variable.
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+# httpx logs every request at INFO, only show its warnings.
+logging.getLogger('httpx').setLevel(logging.WARNING)
 
 # Token for the Bugzilla Sync integration that's registered with Notion.
-notion = Client(auth=os.environ['NOTION_TOKEN'])
+notion = NotionClient(auth=os.environ['NOTION_TOKEN'])
 
 # API key for Bugzilla account.
 bugzilla_api_key = os.environ['BZ_KEY']
@@ -40,11 +45,11 @@ notion_db.update_props()
 # Get all the bugs we want to sync from the Bugzilla API.
 bugs = bzhelper.get_all_bugs(bzquery, bugzilla_api_key)
 num_bugs = len(bugs)
-print(f"Bugzilla API get completed, found {num_bugs} bugs.")
+logging.info("Bugzilla API get completed, found %d bugs.", num_bugs)
 
 # Get all the pages currently in the Notion db.
 pages = notion_db.get_all_pages()
 num_pages = len(pages)
-print(f"Notion API get completed, found {num_pages} pages.")
+logging.info("Notion API get completed, found %d pages.", num_pages)
 
 bzhelper.sync_bugzilla_to_notion(bugs, pages, notion_db)
@@ -1,33 +1,67 @@
 import ghsettings
+import logging
 import os
 import libs.ghhelper as ghhelper
 import libs.notion_data as p
 
-from libs.notion_data import NotionDatabase
-from notion_client import Client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from libs.notion_data import NotionClient, NotionDatabase
+
+# Log level can be overridden with the LOG_LEVEL environment variable.
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+# httpx logs every request at INFO, only show its warnings.
+logging.getLogger('httpx').setLevel(logging.WARNING)
 
 # Initialize Notion client.
-notion = Client(auth=os.environ['NOTION_TOKEN'])
+notion = NotionClient(auth=os.environ['NOTION_TOKEN'])
 
-# Gather issues first so that we can populate select properties accordingly.
-issues = ghhelper.get_all_issues()
-labels = ghhelper.extract_labels(issues)
+# Create database object. The Labels property is added once the issues are known.
+notion_db = NotionDatabase(ghsettings.database_id, notion, ghsettings.properties)
+
+# Recorded as the time of this sync, so issues changed while it runs are fetched next time.
+sync_time = datetime.now(timezone.utc)
+
+# Only fetch issues updated since the last sync, unless GITHUB_FULL_SYNC is set or the last full sync is too old.
+last_sync, last_full_sync = ghhelper.get_last_sync(notion_db)
+force_full_sync = os.environ.get('GITHUB_FULL_SYNC', '').lower() not in ('', '0', 'false')
+full_sync = (force_full_sync or not last_sync or not last_full_sync
+             or sync_time - last_full_sync > ghsettings.full_sync_interval)
+since = None if full_sync else last_sync - ghsettings.sync_overlap
 
-# Extract the milestones for relational purposes.
 milestones_db = NotionDatabase(ghsettings.milestones_id, notion)
-milestones = ghhelper.extract_milestones(milestones_db.get_all_pages())
 
-# Add labels property limited to all known labels
-properties = ghsettings.properties + [p.multi_select('Labels', labels)]
+# Gather the Notion pages and milestones while the issues are downloading from GitHub.
+# The property update below needs the labels, so pages are fetched first and may lack properties
+# the database doesn't have yet. Those pages have no Unique ID and are deleted by the sync.
+with ThreadPoolExecutor() as executor:
+    pages_future = executor.submit(notion_db.get_all_pages)
+    # Extract the milestones for relational purposes. Only the title property is needed, its ID is always "title".
+    milestones_future = executor.submit(
+        lambda: ghhelper.extract_milestones(milestones_db.iter_all_pages(filter_properties=["title"]))
+    )
+
+    # Gather issues first so that we can populate select properties accordingly.
+    issues = ghhelper.get_all_issues(since=since)
 
-# Create database object.
-notion_db = NotionDatabase(ghsettings.database_id, notion, properties)
+    milestones = milestones_future.result()
+    pages = pages_future.result()
+
+# Repos without any pages yet, such as newly added ones, need all of their issues fetched.
+if since:
+    synced_repos = ghhelper.get_synced_repos(pages)
+    new_repos = [repo for repo in ghsettings.repos if repo not in synced_repos]
+    if new_repos:
+        issues.update(ghhelper.get_all_issues(repos=new_repos))
+
+labels = ghhelper.extract_labels(issues)
+
+# Add labels property limited to all known labels
+notion_db.add_property(p.multi_select('Labels', labels))
 
 # Set properties on database.
 notion_db.update_props()
 
-# Gather pages.
-pages = notion_db.get_all_pages()
-
 # Start sync.
-ghhelper.sync_github_to_notion(issues, pages, milestones, notion_db)
+ghhelper.sync_github_to_notion(issues, pages, milestones, notion_db, sync_time,
+                               sync_time if full_sync else last_full_sync)
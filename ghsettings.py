@@ -1,5 +1,7 @@
 import libs.notion_data as p
 
+from datetime import timedelta
+
 # This is the ID of the All GitHub Issues database.
 database_id = "3ca7ed3fe75b4a6d805953156a603540"
 
@@ -9,6 +11,18 @@ milestones_id = "1352df5d45ae8068a42dc799f13ea87a"
 # Name of the org to prefix repos for API calls, with trailing slash.
 orgname = 'thunderbird'
 
+# Issues requested per GraphQL page. Larger pages with nested labels and assignees
+# are more likely to time out on GitHub's side.
+page_size = 50
+
+# Incremental syncs fetch issues updated since the last sync minus this overlap,
+# which covers issues that changed while the previous sync was running.
+sync_overlap = timedelta(hours=1)
+
+# Every issue is fetched again once the last full sync is older than this. This picks up
+# issues whose pages were deleted by hand or that link to milestones added since.
+full_sync_interval = timedelta(days=7)
+
 # Repositories to import issues from.
 repos = [
     "addons-server",
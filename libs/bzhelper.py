@@ -1,7 +1,7 @@
 import dateutil.parser
+import logging
 import requests
 import bzsettings
-import time
 
 from collections import defaultdict
 from datetime import datetime, timedelta
@@ -9,6 +9,9 @@ from typing import Dict, Any
 
 from .notion_data import NotionDatabase
 
+log = logging.getLogger(__name__)
+
+
 def bug_status_to_notion(bug: Dict[str, Any]) -> str:
     """Convert a Bugzilla status to values suitable for Notion."""
     done = ["VERIFIED", "RESOLVED"]
@@ -90,30 +93,25 @@ def remove_duplicates(pages, notion_db):
     """Removes duplicate pages based on bug numbers, keeping only
        one page per bug number."""
     bug_to_pages = defaultdict(list)
-    total_deleted = 0   # Total number of duplicates deleted
 
     # Map each bug number to its corresponding pages
     for page in pages:
         bug_number = page["properties"]["Bug Number"]["number"]
         bug_to_pages[bug_number].append(page)
 
-    # Iterate over the bug numbers and delete duplicate pages
+    # Collect duplicate pages, keeping the first page for each bug number
+    duplicate_ids = set()
     for bug_number, page_list in bug_to_pages.items():
-        if len(page_list) > 1:
-            # Keep the first page and delete the rest
-            pages_to_delete = page_list[1:]
-            for page in pages_to_delete:
-                notion_db.delete_page(page["id"])
-                pages.remove(page)
-                total_deleted += 1
-
-                if total_deleted % 20 == 0:
-                    print(f"Total duplicates deleted: {total_deleted}")
-                    print("Pausing for 10 seconds...")
-                    time.sleep(10)
+        duplicate_ids.update(page["id"] for page in page_list[1:])
+
+    # Delete the duplicates and drop them from `pages`
+    if duplicate_ids:
+        notion_db.delete_pages(list(duplicate_ids))
+        pages[:] = [page for page in pages if page["id"] not in duplicate_ids]
+    total_deleted = len(duplicate_ids)
 
     # Print final total of duplicates deleted
-    print(f"Total duplicates deleted: {total_deleted}")
+    log.info("Total duplicates deleted: %d", total_deleted)
 
 
 def sync_bugzilla_to_notion(bugs, pages, notion_db):
@@ -122,43 +120,32 @@ def sync_bugzilla_to_notion(bugs, pages, notion_db):
     # dict of bug numbers: pages for bugs in the notion db
     pages_bugs = {p["properties"]["Bug Number"]["number"]:p for p in pages}
 
-    added = 0
-    updated = 0
     skipped = 0
-    deleted = 0
-    last_skip = False
 
     # delete pages that no longer match the criteria to be included
-    for bnum in pages_bugs.keys():
-        if bnum not in bugs.keys() or skip_status(bugs[bnum]) or list(bugs.keys()).count(bnum) > 1:
-            notion_db.delete_page(pages_bugs[bnum]["id"])
-            deleted += 1
+    stale_ids = [page["id"] for bnum, page in pages_bugs.items() if bnum not in bugs or skip_status(bugs[bnum])]
+    notion_db.delete_pages(stale_ids)
+    deleted = len(stale_ids)
 
     # If we somehow have duplicates in Notion, remove them.
     remove_duplicates(pages, notion_db)
 
-    # Add or update pages corresponding to bugs.
+    # Add or update pages corresponding to bugs, sending the changes to Notion concurrently.
+    creates = []
+    updates = []
     for bug in bugs.values():
-        # Sleep for a bit if we're hammering the Notion API.
-        total_changes = added + updated
-        if not last_skip and total_changes > 0 and total_changes % 20 == 0:
-            print(f"Added {added} bugs, updated {updated}, deleted {deleted} and skipped {skipped}")
-            print("Sleeping for 10 seconds...")
-            time.sleep(10)
-        # We only skip pausing for one iteration after a skip, so this resets.
-        last_skip = False
-
         if skip_status(bug):
                 skipped += 1
-                last_skip = True
-        elif bug["id"] in pages_bugs.keys():
-            if notion_db.update_page(pages_bugs[bug["id"]], map_bug_to_page(bug)):
-                updated += 1
+        elif bug["id"] in pages_bugs:
+            updates.append((pages_bugs[bug["id"]], map_bug_to_page(bug)))
         else:
-            if notion_db.create_page(map_bug_to_page(bug)):
-                added += 1
+            creates.append(map_bug_to_page(bug))
+
+    updated = notion_db.update_pages(updates)
+    added = notion_db.create_pages(creates)
 
     # Finish up and summarize results.
     timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
     pagecount = len(pages)
-    print(f"{timestamp} synced {bugcount} bugs in query, {pagecount} in Notion: Added {added}, updated {updated}, deleted {deleted} and skipped {skipped}")
+    log.info("%s synced %d bugs in query, %d in Notion: Added %d, updated %d, deleted %d and skipped %d",
+             timestamp, bugcount, pagecount, added, updated, deleted, skipped)
@@ -1,25 +1,94 @@
+import functools
 import ghsettings
+import httpx
+import logging
+import orjson
 import os
-import requests
+import re
 import time
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from sgqlc.endpoint.http import HTTPEndpoint
 from sgqlc.operation import Operation
-from sgqlc_schemas import github_schema as schema
-from typing import Dict, Any
+from sgqlc.types import Arg, String, Variable
+from typing import Dict, Any, List, Optional, Tuple
 
-def map_issue_to_page(issue, milestones, page_status=None):
+log = logging.getLogger(__name__)
+
+# Format of the sync times recorded in the database description.
+SYNC_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@functools.cache
+def github_schema():
+    """Import the GitHub schema on first use, it is large and slow to load."""
+    from sgqlc_schemas import github_schema as schema
+    return schema
+
+
+class FastEndpoint(HTTPEndpoint):
+    """
+    A GraphQL HTTP endpoint that uses orjson to encode queries and decode responses.
+    Requests go through a single httpx client so the connection to GitHub is kept alive between calls.
+    Requests that fail to connect or get a 502, 503 or 504 response are retried with exponential backoff.
+    """
+    retry_statuses = {502, 503, 504}
+
+    def __init__(self, url, base_headers=None, timeout=None, max_retries=5):
+        super().__init__(url, base_headers, timeout)
+        self.max_retries = max_retries
+        transport = httpx.HTTPTransport(retries=max_retries)
+        self.client = httpx.Client(headers=self.base_headers, timeout=self.timeout, transport=transport)
+
+    def __call__(self, query, variables=None, operation_name=None):
+        if not isinstance(query, str):
+            query = bytes(query).decode('utf-8')
+        body = orjson.dumps({'query': query, 'variables': variables, 'operationName': operation_name})
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+
+        # The first attempt isn't a retry, so the request is always sent at least once.
+        for attempt in range(self.max_retries + 1):
+            response = self.client.post(self.url, content=body, headers=headers)
+            if response.status_code not in self.retry_statuses or attempt == self.max_retries:
+                break
+            time.sleep(2 ** attempt)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+
+        if data.get('errors'):
+            return self._log_graphql_error(query, data)
+        return data
+
+
+@functools.cache
+def github_endpoint():
+    """Return the GraphQL endpoint shared by all GitHub queries."""
+    return FastEndpoint('https://api.github.com/graphql', {'Authorization': f'Bearer {os.getenv("GITHUB_TOKEN")}'})
+
+
+def map_issue_to_page(issue, reponame, milestones, page_status=None):
     """Map a single issue's data into the datadict format for the NotionDatabase class. """
+    # Collect label names and the milestone pages for any "M:" labels in a single pass.
+    labels = []
+    issue_milestones = []
+    for label in issue.labels.nodes:
+        labels.append(label.name)
+        if label.name.startswith("M:"):
+            milestone = label.name[2:].strip()
+            if milestone in milestones:
+                issue_milestones.append(milestones[milestone])
+
     notion_data = {
         'Assignee': ' '.join(a.login for a in issue.assignees.nodes) if issue.assignees.nodes else '',
         'Link': issue.url,
         'Title': issue.title,
-        'Repository': issue.repository.name,
+        'Repository': reponame,
         'Unique ID': issue.id,
         'Opened': issue.created_at,
         'Closed': issue.closed_at,
-        'Labels': [l.name for l in issue.labels.nodes],
+        'Labels': labels,
+        'Milestones': issue_milestones,
     }
 
     # Assign 'Done' to closed tickets
@@ -30,34 +99,35 @@ def map_issue_to_page(issue, milestones, page_status=None):
     if page_status == "Done" and issue.state == "OPEN":
         notion_data['Status'] = "Not started"
 
-    filtered_labels = [label[2:].strip() for label in notion_data['Labels'] if label.startswith("M:") and label[2:].strip() in milestones]
-    notion_data['Milestones'] = [milestones[label] for label in filtered_labels]
-
-    # for label in issue.get_labels():
     return notion_data
 
 
-def get_issues_from_repo(reponame):
-    endpoint = HTTPEndpoint('https://api.github.com/graphql', {'Authorization': f'Bearer {os.getenv("GITHUB_TOKEN")}'})
+def get_issues_from_repo(reponame, since=None, endpoint=None):
+    endpoint = endpoint or github_endpoint()
+
+    # GitHub cursors are opaque, so pages can't be requested ahead of time. Build the query once
+    # with the cursor as a variable and only send new variables for each page.
+    op = Operation(github_schema().query_type, variables={'cursor': Arg(String)})
+    # Optionally only request issues updated at or after `since`.
+    filters = {'filter_by': {'since': since}} if since else {}
+    issues = op.repository(owner=ghsettings.orgname, name=reponame).issues(first=ghsettings.page_size, after=Variable('cursor'), **filters)
+    issues.nodes.created_at()
+    issues.nodes.closed_at()
+    issues.nodes.title()
+    issues.nodes.state()
+    issues.nodes.url()
+    issues.nodes.id()
+    issues.nodes.labels(first=100).nodes.name()
+    issues.nodes.assignees(first=10).nodes.login()
+    issues.page_info.__fields__(has_next_page=True)
+    issues.page_info.__fields__(end_cursor=True)
+
     has_next_page = True
     cursor = None
 
     all_issues = []
     while has_next_page:
-        op = Operation(schema.query_type)
-        issues = op.repository(owner=ghsettings.orgname, name=reponame).issues(first=100, after=cursor)
-        issues.nodes.created_at()
-        issues.nodes.closed_at()
-        issues.nodes.title()
-        issues.nodes.state()
-        issues.nodes.url()
-        issues.nodes.id()
-        issues.nodes.repository().name()
-        issues.nodes.labels(first=100).nodes.name()
-        issues.nodes.assignees(first=10).nodes.login()
-        issues.page_info.__fields__(has_next_page=True)
-        issues.page_info.__fields__(end_cursor=True)
-        data = endpoint(op)
+        data = endpoint(op, {'cursor': cursor})
 
         # sgqlc magic to turn the response into an object rather than a dict
         repo = (op + data).repository
@@ -69,12 +139,20 @@ def get_issues_from_repo(reponame):
     return all_issues
 
 
-def get_all_issues(status: str = 'all') -> Dict[str, Any]:
-    """Get all issues from repo """
-    all_issues = {}
-    for r in ghsettings.repos:
-        all_issues[r] = get_issues_from_repo(r)
-    return all_issues
+def get_all_issues(status: str = 'all', since: datetime = None, max_workers: int = 4,
+                   repos: List[str] = None) -> Dict[str, Any]:
+    """
+    Get all issues from every repo in `repos`, or all configured repos, fetching several repos concurrently.
+    If `since` is given, only issues updated at or after that time are returned.
+    """
+    repos = ghsettings.repos if repos is None else repos
+    # Set up the shared endpoint and load the schema before fanning out, functools.cache doesn't stop
+    # several threads from creating their own on a simultaneous first call.
+    endpoint = github_endpoint()
+    github_schema()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        repo_issues = executor.map(lambda r: get_issues_from_repo(r, since, endpoint), repos)
+        return dict(zip(repos, repo_issues))
 
 
 def extract_labels(issues):
@@ -100,40 +178,75 @@ def extract_milestones(pages):
     return milestones
 
 
-def sync_github_to_notion(issues, pages, milestones, notion_db):
+def parse_sync_time(value: Optional[str]) -> Optional[datetime]:
+    """Parse a sync time written by sync_github_to_notion, or return None if it's missing or malformed."""
+    try:
+        return datetime.strptime(value, SYNC_TIME_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_last_sync(notion_db) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Return the times of the last sync and the last full sync recorded in the database description.
+    Either is None if it isn't recorded.
+    """
+    times = dict(re.findall(r"^(Last Sync|Last Full Sync): (.*) UTC$", notion_db.description, re.MULTILINE))
+    return parse_sync_time(times.get("Last Sync")), parse_sync_time(times.get("Last Full Sync"))
+
+
+def get_synced_repos(pages):
+    """Return the names of the repos that have at least one page in Notion."""
+    repos = set()
+    for page in pages:
+        repo = page["properties"].get("Repository", {}).get("select")
+        if repo:
+            repos.add(repo["name"])
+    return repos
+
+
+def sync_github_to_notion(issues, pages, milestones, notion_db, sync_time, full_sync_time=None):
+    """
+    Sync `issues` to `pages` in `notion_db`, then record the sync times in the database description.
+    `sync_time` must be taken before the issues were fetched, so the next sync covers anything changed since.
+    `full_sync_time` is when every issue was last fetched, if ever.
+    """
     # Create dict of {issue_id: notion_page} for issues in the notion db.
+    # Unique ID is the node ID from GitHub. All issues must have one, pages without one are deleted.
     pages_issues = {}
+    orphans = []
     for p in pages:
-        try:
-            # Unique ID is the node ID from GitHub. All issues must have one.
-            key = p["properties"]["Unique ID"]["rich_text"][0]["plain_text"]
-            pages_issues[key] = p
-        except IndexError:
-            print(f"Error: Page {p['id']} has no Unique ID! Deleting it...")
-            notion_db.delete_page(p['id'])
-            continue
-
-    added = 0
-    updated = 0
+        # Pages are fetched before update_props runs, so the database may not have a Unique ID property yet.
+        unique_id = p["properties"].get("Unique ID", {}).get("rich_text")
+        if unique_id:
+            pages_issues[unique_id[0]["plain_text"]] = p
+        else:
+            log.error("Page %s has no Unique ID! Deleting it...", p['id'])
+            orphans.append(p['id'])
+    if orphans:
+        notion_db.delete_pages(orphans)
+
+    # Map every issue first, then send the page creates and updates to Notion concurrently.
+    creates = []
+    updates = []
     issue_count = 0
-    for repo in issues.values():
+    for reponame, repo in issues.items():
         issue_count += len(repo)
         for issue in repo:
-            if issue.id in pages_issues.keys():
+            if issue.id in pages_issues:
                 page = pages_issues[issue.id]
-                page_status = page.get('properties').get('Status').get('status').get('name')
-                if notion_db.update_page(page, map_issue_to_page(issue, milestones, page_status)):
-                    updated += 1
+                page_status = notion_db.page_status(page)
+                updates.append((page, map_issue_to_page(issue, reponame, milestones, page_status)))
             else:
-                if notion_db.create_page(map_issue_to_page(issue, milestones)):
-                    added += 1
-                        # Sleep for a bit if we're hammering the Notion API.
-            total_changes = added + updated
-            if total_changes > 0 and total_changes % 20 == 0:
-                print(f"Added {added} issues, updated {updated}")
-                print("Sleeping for 10 seconds...")
-                time.sleep(10)
-    timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+                creates.append(map_issue_to_page(issue, reponame, milestones))
+
+    updated = notion_db.update_pages(updates)
+    added = notion_db.create_pages(creates)
+    timestamp = sync_time.strftime(SYNC_TIME_FORMAT)
     page_count = len(pages)
-    notion_db.description = f"Last Sync: {timestamp} UTC"
-    print(f"{timestamp} synced {issue_count} issues in query, {page_count} were in Notion: Added {added} and updated {updated}.")
+    description = f"Last Sync: {timestamp} UTC"
+    if full_sync_time:
+        description += f"\nLast Full Sync: {full_sync_time.strftime(SYNC_TIME_FORMAT)} UTC"
+    notion_db.description = description
+    log.info("%s synced %d issues in query, %d were in Notion: Added %d and updated %d.",
+             timestamp, issue_count, page_count, added, updated)
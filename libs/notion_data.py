@@ -1,8 +1,69 @@
+import httpx
+import logging
+import orjson
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Dict, List, Callable
+from notion_client import APIErrorCode, APIResponseError, Client
+from typing import Any, Dict, List, Callable, Optional, Tuple
 
-@dataclass
+log = logging.getLogger(__name__)
+
+# Sentinel for datadict properties that aren't set, since None is a valid value for some properties.
+_MISSING = object()
+
+class RateLimiter:
+    """
+    Token bucket limiting calls to an average of `rate` per second, allowing bursts of up to `burst` calls.
+    Safe to share between threads.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens can go negative, which reserves a slot for this call after the calls already waiting.
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+# Notion allows an average of 3 requests per second per integration, so all databases share one limiter.
+notion_rate_limiter = RateLimiter(rate=3, burst=5)
+
+class OrjsonHTTPClient(httpx.Client):
+    """An httpx client that encodes JSON request bodies with orjson."""
+    def build_request(self, method, url, *, json=None, headers=None, **kwargs):
+        if json is not None:
+            kwargs['content'] = orjson.dumps(json)
+            headers = httpx.Headers(headers)
+            headers['Content-Type'] = 'application/json'
+        return super().build_request(method, url, headers=headers, **kwargs)
+
+class NotionClient(Client):
+    """A Notion API client that uses orjson to encode requests and decode successful responses."""
+    def __init__(self, **kwargs):
+        super().__init__(client=OrjsonHTTPClient(), **kwargs)
+
+    def _parse_response(self, response: httpx.Response) -> Any:
+        # Errors are left to notion_client so they still raise the right exception types.
+        if response.is_success:
+            return orjson.loads(response.content)
+        return super()._parse_response(response)
+
+@dataclass(slots=True)
 class NotionProperty:
     """
     Defines a generic Notion database property. It must contain functions to let you check whether
@@ -15,6 +76,11 @@ class NotionProperty:
     _update: Callable[[Any], Dict[str, Any]] = None
     _diff: Callable[[Dict[str, Any], Any], bool] = None
 
+    def __post_init__(self):
+        # Interned so the schema and every page payload built from this property share one copy of each string.
+        self.name = sys.intern(self.name)
+        self.type = sys.intern(self.type)
+
     def to_dict(self):
         """ Returns a dict that defines this property in the Notion API format. """
         return {
@@ -44,24 +110,62 @@ class NotionDatabase:
     The Status property is special and can't be modified by the Notion API.
     Similarly, the Title property can't be deleted or modified, though the name can be changed.
     """
-    def __init__(self, database_id: str, notion_client: Any, properties: List[NotionProperty] = None):
+    def __init__(self, database_id: str, notion_client: Any, properties: List[NotionProperty] = None,
+                 max_retries: int = 5):
         self.properties: Dict[str, NotionProperty] = {}
+        # Flat (name, diff function, update function) entries for the per-page loops, see add_property.
+        self._prop_table: Tuple[Tuple[str, Callable, Callable], ...] = ()
         if properties:
             for prop in properties:
                 self.add_property(prop)
         self.notion = notion_client
         self.database_id = database_id
+        self.max_retries = max_retries
+        # (time.monotonic() timestamp, database object) last returned by Notion, see _retrieve_database.
+        self._database_cache = None
+
+    def _request(self, func: Callable, *args, **kwargs):
+        """
+        Call the Notion API function `func` within the shared rate limit, retrying if Notion rate limits the request.
+        Waits for the Retry-After header sent with the 429 response, or backs off exponentially without it.
+        """
+        # The first attempt isn't a retry, so the request is always sent at least once.
+        for attempt in range(self.max_retries + 1):
+            notion_rate_limiter.acquire()
+            try:
+                return func(*args, **kwargs)
+            except APIResponseError as e:
+                if e.code != APIErrorCode.RateLimited or attempt == self.max_retries:
+                    raise
+                time.sleep(float(e.headers.get("Retry-After", 2 ** attempt)))
+
+    def _retrieve_database(self, max_age: float = 30.0) -> Dict[str, Any]:
+        """
+        Return the remote database object, reusing the last response if it's less than `max_age` seconds old.
+        The age limit is short so changes made in the Notion UI are still picked up by the next sync.
+        """
+        if self._database_cache:
+            timestamp, database = self._database_cache
+            if time.monotonic() - timestamp < max_age:
+                return database
+        database = self._request(self.notion.databases.retrieve, database_id=self.database_id)
+        self._database_cache = (time.monotonic(), database)
+        return database
+
+    def _update_database(self, **kwargs):
+        """Update the remote database, caching the updated database object that Notion returns."""
+        database = self._request(self.notion.databases.update, database_id=self.database_id, **kwargs)
+        self._database_cache = (time.monotonic(), database)
 
     @property
     def description(self):
-        database_info = self.notion.databases.retrieve(self.database_id)
+        database_info = self._retrieve_database()
         # Extract and return the description as plain text.
         return "".join([item["text"]["content"] for item in database_info.get("description", [])])
 
     @description.setter
     def description(self, new_desc):
-        self.notion.databases.update(
-            database_id=self.database_id,
+        self._update_database(
             description=[
                 { "type": "text",
                     "text": {
@@ -72,42 +176,43 @@ class NotionDatabase:
         )
 
 
-    def get_all_pages(self):
-        """ Gets all pages currently in the Notion database. """
-        pages = []
+    def iter_all_pages(self, filter_properties: List[str] = None):
+        """
+        Yields every page currently in the Notion database, one query of results at a time.
+        `filter_properties` is an optional list of property IDs to limit the properties returned for each page.
+        """
         cursor = None
+        # Only send filter_properties when it's used, an empty list would return no properties at all.
+        filters = {"filter_properties": filter_properties} if filter_properties else {}
 
         while True:
-            response = self.notion.databases.query(
+            response = self._request(
+                self.notion.databases.query,
                 self.database_id,
                 start_cursor=cursor,
-                page_size=100
+                page_size=100,
+                **filters
             )
-            pages.extend(response["results"])
+            yield from response["results"]
             cursor = response.get("next_cursor")
 
             if cursor is None:
                 break
 
-        return pages
+    def get_all_pages(self):
+        """ Gets all pages currently in the Notion database. """
+        return list(self.iter_all_pages())
 
     def dict_to_page(self, datadict: Dict[str, Any]):
         """
         Takes a `datadict` and returns a Notion database page formatted for the Notion API.
         A datadict is a dictionary containing {<property_name>: <data>}.
         """
-        props = self.properties
-        page = {}
-
-        if datadict.get('Status'):
-            page = {
-                "Status": {"status": {"name": datadict.pop('Status')}}
-            }
-
-        for key, value in datadict.items():
-            if key in props:
-                page.update(props[key].update_content(value))
-
+        page = {"Status": {"status": {"name": datadict['Status']}}} if datadict.get('Status') else {}
+        for prop_name, _, update in self._prop_table:
+            value = datadict.get(prop_name, _MISSING)
+            if value is not _MISSING:
+                page.update(update(value))
         return page
 
     def create_page(self, datadict: Dict[str, Any]) -> bool:
@@ -115,47 +220,100 @@ class NotionDatabase:
         Create a new page in the Notion database.
         `datadict` must be a dictionary containing {<property_name>: <data>}.
         """
+        if not datadict:
+            return False
         page_data = self.dict_to_page(datadict)
         if page_data:
-            self.notion.pages.create(parent={"database_id": self.database_id}, properties=page_data)
+            self._request(self.notion.pages.create, parent={"database_id": self.database_id}, properties=page_data)
             return True
         return False
 
+    def create_pages(self, datadicts: List[Dict[str, Any]], max_workers: int = 3) -> int:
+        """Create a page for each datadict in `datadicts` concurrently. Returns the number of pages created."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return sum(executor.map(self.create_page, datadicts))
+
     def delete_page(self, page_id):
         """Delete a page in the remote Notion database by `page_id`."""
-        self.notion.pages.update(page_id, archived=True)
+        self._request(self.notion.pages.update, page_id, archived=True)
+
+    def delete_pages(self, page_ids: List[str], max_workers: int = 3):
+        """Delete several pages in the remote Notion database concurrently."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self.delete_page, page_ids))
 
     def update_page(self, page: Dict[str, Any], datadict: Dict[str, Any]) -> bool:
-        """Update `page` with the data in `datadict`. Updates only occur if `page` and `datadict` are different."""
-        if self.page_diff(datadict, page):
-            data = self.dict_to_page(datadict)
-            self.notion.pages.update(page['id'], properties=data)
+        """
+        Update `page` with the data in `datadict`. Updates only occur if `page` and `datadict` are different,
+        and only the properties that differ are sent.
+        """
+        data = self.page_changes(datadict, page)
+        if data:
+            self._request(self.notion.pages.update, page['id'], properties=data)
             return True
         return False
 
+    def update_pages(self, updates: List[Tuple[Dict[str, Any], Dict[str, Any]]], max_workers: int = 3) -> int:
+        """
+        Apply each `(page, datadict)` pair in `updates` with `update_page` concurrently.
+        Returns the number of pages that were updated.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return sum(executor.map(lambda update: self.update_page(*update), updates))
+
+    @staticmethod
+    def page_status(page: Dict[str, Any]) -> Optional[str]:
+        """Return the name of `page`'s Status, or None if the page has no Status set."""
+        status = page["properties"].get("Status", {}).get("status")
+        return status["name"] if status else None
+
     def page_diff(self, datadict: Dict[str, Any], page: Dict[str, Any]) -> bool:
         """Return true or false based on whether the Notion `datadict` matches `page` or not."""
-        cur_props = self.properties
+        page_props = page["properties"]
 
         # The status property needs special handling if it exists since it isn't a registered property.
-        if datadict.get('Status') and datadict['Status'] != page['properties']['Status']['status']['name']:
+        if datadict.get('Status') and datadict['Status'] != self.page_status(page):
             return True
         # Loop over all properties and see if any are different.
-        for prop_name, prop_value in datadict.items():
-            if prop_name in cur_props and cur_props[prop_name].is_prop_diff(page["properties"].get(prop_name, {}), prop_value):
+        for prop_name, diff, _ in self._prop_table:
+            value = datadict.get(prop_name, _MISSING)
+            if value is not _MISSING and diff(page_props.get(prop_name, {}), value):
                 return True
         return False
 
+    def page_changes(self, datadict: Dict[str, Any], page: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Diff `datadict` against `page` and format the differing properties for the Notion API in the same pass.
+        Returns an empty dict if `page` already matches `datadict`.
+        """
+        page_props = page["properties"]
+        changes = {}
+
+        # The status property needs special handling if it exists since it isn't a registered property.
+        status = datadict.get('Status')
+        if status and status != self.page_status(page):
+            changes["Status"] = {"status": {"name": status}}
+        for prop_name, diff, update in self._prop_table:
+            value = datadict.get(prop_name, _MISSING)
+            if value is not _MISSING and diff(page_props.get(prop_name, {}), value):
+                changes.update(update(value))
+        return changes
+
     def add_property(self, prop: NotionProperty):
         """Adds a property to the local instance of the Notion database."""
         self.properties[prop.name] = prop
+        # Call the property functions directly in the per-page loops. If one is missing, fall back to the
+        # NotionProperty method so the usual error is raised.
+        self._prop_table = tuple(
+            (name, p._diff or p.is_prop_diff, p._update or p.update_content) for name, p in self.properties.items()
+        )
 
     def to_dict(self):
         """Returns the property definition in the right format to modify a Notion database."""
         return {name: prop.to_dict() for name, prop in self.properties.items()}
 
     def get_props(self):
-        return self.notion.databases.retrieve(database_id=self.database_id)
+        return self._retrieve_database()
 
     def update_props(self):
         """Updates the properties of the remote Notion database tied to the local instance."""
@@ -163,30 +321,29 @@ class NotionDatabase:
         desired_props = self.to_dict()
 
         # Fetch the current properties of the database.
-        current_db = self.notion.databases.retrieve(database_id=self.database_id)
+        current_db = self._retrieve_database()
         current_props = current_db["properties"]
 
+        # Collect every property change so the schema is updated with a single request.
+        properties = {}
+
         # Process current properties: delete properties not in desired list, and add/update missing ones
         # The status and title properties cannot be deleted via the API.
         for prop_name, prop_info in current_props.items():
             if prop_name not in desired_props and prop_info["type"] not in ["status", "title"]:
-                self.notion.databases.update(
-                    database_id=self.database_id,
-                    properties={prop_name: None}
-                )
+                properties[prop_name] = None
 
         # Add or update missing properties
         for prop_name, prop_schema in desired_props.items():
             if prop_name not in current_props or current_props[prop_name]["type"] != prop_schema["type"]:
                 if prop_schema["type"] == 'title':
                     # The title property always has the id "title" so can be renamed that way.
-                    properties = {"title": {"name": prop_name}}
+                    properties["title"] = {"name": prop_name}
                 else:
-                    properties = {prop_name: prop_schema}
-                self.notion.databases.update(
-                    database_id=self.database_id,
-                    properties=properties
-                )
+                    properties[prop_name] = prop_schema
+
+        if properties:
+            self._update_database(properties=properties)
 
 # Property creation functions
 # Each must have an _update function and _diff function.
@@ -201,12 +358,9 @@ def date(name: str) -> NotionProperty:
             return {name: {"date": None}}
 
     def _diff(property_data: Dict[str, Any], content: datetime) -> bool:
-        property_data = property_data.get("date").get("start") if property_data.get("date") else None
-        if content:
-            content = content.date().isoformat()
-        if property_data != content:
-            return True
-        return False
+        # Compare both sides as ISO date strings, or None when there is no date.
+        start = (property_data.get("date") or {}).get("start")
+        return start != (content.date().isoformat() if content else None)
 
     return NotionProperty(name=name, type='date', additional={'date': {}}, _update=_update, _diff=_diff)
 
@@ -216,11 +370,7 @@ def link(name: str) -> NotionProperty:
         return {name: {"url": content}}
 
     def _diff(property_data: Dict[str, Any], content: str) -> bool:
-        if "url" not in property_data:
-            return True
-        if property_data.get("url") != content:
-            return True
-        return False
+        return "url" not in property_data or property_data["url"] != content
 
     return NotionProperty(name=name, type='url', additional={'url': {}}, _update=_update, _diff=_diff)
 
@@ -230,13 +380,9 @@ def rich_text(name: str) -> NotionProperty:
         return {name: {"rich_text": [{"text": {"content": content}}]}}
 
     def _diff(property_data: Dict[str, Any], content: str) -> bool:
-        if "rich_text" not in property_data:
-            return True
-        if len(property_data["rich_text"]) == 0:
-            return True
-        if property_data["rich_text"][0]["plain_text"] != content:
-            return True
-        return False
+        # Missing or empty text always counts as different.
+        text = property_data.get("rich_text")
+        return not text or text[0]["plain_text"] != content
 
     return NotionProperty(name=name, type='rich_text', additional={'rich_text': {}}, _update=_update, _diff=_diff)
 
@@ -246,27 +392,24 @@ def number(name: str) -> NotionProperty:
         return {name: {"number": content}}
 
     def _diff(property_data: Dict[str, Any], content: int) -> bool:
-        if "number" not in property_data:
-            return True
-        if property_data.get("number") != content:
-            return True
-        return False
+        return "number" not in property_data or property_data["number"] != content
 
     return NotionProperty(name=name, type='number', additional={'number': {}}, _update=_update, _diff=_diff)
 
 
 def select(name: str, options: List[str]) -> NotionProperty:
+    options_set = frozenset(options)
+
     def _update(content: str) -> Dict[str, Any]:
-        if content not in options:
+        if content not in options_set:
             raise ValueError(f"Invalid option: {content}. Must be one of {options}.")
         return {name: {"select": {"name": content}}}
 
     def _diff(property_data: Dict[str, Any], content: str) -> bool:
         if "select" not in property_data:
             return True
-        if property_data.get("select", {}).get("name") != content:
-            return True
-        return False
+        # An empty select is returned as None rather than an empty dict.
+        return (property_data["select"] or {}).get("name") != content
 
     return NotionProperty(
         name=name, type='select',
@@ -276,22 +419,25 @@ def select(name: str, options: List[str]) -> NotionProperty:
 
 
 def multi_select(name: str, options: List[str]) -> NotionProperty:
+    # Check content against a set, the Labels property can have hundreds of options.
+    options_set = frozenset(options)
+
     def _update(content: List[str]) -> Dict[str, Any]:
-            vals = []
-            for val in content:
-                if val not in options:
-                    raise ValueError(f"Invalid option: {val}. Must be one of {options}.")
-                vals.append({"name": val})
-            return {name: {"multi_select": vals}}
+        invalid = next((val for val in content if val not in options_set), None)
+        if invalid is not None:
+            raise ValueError(f"Invalid option: {invalid}. Must be one of {options}.")
+        return {name: {"multi_select": [{"name": val} for val in content]}}
 
     def _diff(property_data: Dict[str, Any], content: List[str]) -> bool:
         if "multi_select" not in property_data:
             return True
-        vals = [v["name"] for v in property_data["multi_select"]]
-        if set(vals) == set(content):
+        vals = {v["name"] for v in property_data["multi_select"]}
+        content_vals = set(content)
+        if vals == content_vals:
             return False
-        if {s.lower() for s in vals} == {s.lower() for s in content}:
-            print(f"Case Warning!\n{vals} | {content}\n")
+        # Only build the lowercased sets if the warning would actually be logged.
+        if log.isEnabledFor(logging.WARNING) and {s.lower() for s in vals} == {s.lower() for s in content_vals}:
+            log.warning("Case Warning! %s | %s", vals, content)
         return True
 
     return NotionProperty(
@@ -323,12 +469,8 @@ def title(name: str) -> NotionProperty:
         return {name: {"type": "title", "title": [{"text": {"content": content}}]}}
 
     def _diff(property_data: Dict[str, Any], content: str) -> bool:
-        if "title" not in property_data:
-            return True
-        if len(property_data["title"]) == 0:
-            return True
-        if property_data["title"][0]["plain_text"] != content:
-            return True
-        return False
+        # Missing or empty text always counts as different.
+        text = property_data.get("title")
+        return not text or text[0]["plain_text"] != content
 
     return NotionProperty(name=name, type='title', additional={}, _update=_update, _diff=_diff)